@@ -1,19 +1,47 @@
 """Whisper ASR MCP Server with HTTP transport."""
 
-import base64
+import asyncio
+import contextlib
+import functools
+import mimetypes
 import os
+import re
+import secrets
+import tempfile
+from collections import OrderedDict
 from enum import Enum
-from typing import Optional
+from typing import IO, Any, Awaitable, AsyncIterable, AsyncIterator, Optional, Union
 
 import httpx
 from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel, Field
 
+try:
+    # SIMD-accelerated (AVX2/SSSE3/NEON) drop-in for the stdlib decoder
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    # Parses straight from bytes, several times faster than the stdlib
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    # SIMD and multithreaded; SHA-256 (SHA-NI accelerated) otherwise
+    from blake3 import blake3 as content_hash
+except ImportError:
+    from hashlib import sha256 as content_hash
+
 # Configuration from environment
 WHISPER_ASR_URL = os.getenv("WHISPER_ASR_URL", "http://localhost:9000")
 FFMPEG_API_URL = os.getenv("FFMPEG_API_URL", "http://192.168.2.16:3030")
 MCP_HOST = os.getenv("MCP_HOST", "0.0.0.0")
 MCP_PORT = int(os.getenv("MCP_PORT", "3020"))
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "32"))
+ASR_CONCURRENCY = int(os.getenv("ASR_CONCURRENCY", "2"))
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", "4"))
 
 # MCP Server Instructions
 MCP_INSTRUCTIONS = """
@@ -38,7 +66,7 @@ transcribe(audio_path="/media/inbound/recording.m4a")
 transcribe(audio_url="https://example.com/audio.mp3")
 ```
 
-**From base64 data:**
+**From base64 data (only when the audio is not reachable by path or URL):**
 ```
 transcribe(audio_base64="SGVsbG8gV29ybGQ=...")
 ```
@@ -57,16 +85,17 @@ transcribe(audio_path="/media/inbound/video.mp4", output_format="srt")
 
 ## Response Structure
 Returns a dictionary:
-- `transcription`: The transcribed text/content
+- `transcription`: The transcribed text/content (a JSON object for `json`)
 - `detected_language`: Auto-detected language code (e.g., "en")
 - `output_format`: The format used
 
 ## Best Practices
 1. Use `audio_path` for files in `/media/inbound/`
-2. Language is auto-detected - no need to specify
-3. Any ffmpeg-supported format works (mp3, wav, m4a, flac, webm, etc.)
-4. Long files may take several minutes - be patient
-5. For subtitles, use `srt` or `vtt` output formats
+2. Prefer `audio_path` or `audio_url` over `audio_base64`: base64 is ~33% larger and must be decoded
+3. Language is auto-detected - no need to specify
+4. Any ffmpeg-supported format works (mp3, wav, m4a, flac, webm, etc.)
+5. Long files may take several minutes - be patient
+6. For subtitles, use `srt` or `vtt` output formats
 
 ## Error Handling
 Errors return `{"error": "description"}`. Common issues:
@@ -75,6 +104,52 @@ Errors return `{"error": "description"}`. Common issues:
 - Transcription failed: Service may be unavailable
 """
 
+# Shared backend clients, created lazily on the server's event loop so that
+# connections are pooled and kept alive across tool calls
+_WHISPER_CLIENT: Optional[httpx.AsyncClient] = None
+_FFMPEG_CLIENT: Optional[httpx.AsyncClient] = None
+_FETCH_CLIENT: Optional[httpx.AsyncClient] = None
+_CLIENT_LOCK = asyncio.Lock()
+_CLIENT_LIMITS = httpx.Limits(
+    max_keepalive_connections=20,
+    max_connections=40,
+    keepalive_expiry=30,
+)
+
+# Backend requests beyond these limits queue here instead of piling onto
+# whisper-asr (GPU memory) and ffmpeg-api (worker pool)
+_ASR_SEMAPHORE = asyncio.Semaphore(ASR_CONCURRENCY)
+_FFMPEG_SEMAPHORE = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+
+# Audio is streamed through spooled temporary files: kept in memory up to
+# SPOOL_MAX_SIZE, then moved to disk, and read/written in CHUNK_SIZE pieces
+SPOOL_MAX_SIZE = 8 << 20
+CHUNK_SIZE = 1 << 20
+# Local files above this size get a sequential readahead hint
+LARGE_FILE_SIZE = 32 << 20
+# Base64 text decoded per step, a whole number of 4-character groups
+B64_CHUNK_SIZE = 4 * (CHUNK_SIZE // 4)
+# Characters base64.b64decode discards (line breaks, data: URI punctuation, ...)
+_B64_IGNORED = re.compile(r"[^A-Za-z0-9+/=]+")
+
+# Multipart bodies share one random boundary, so the framing around each kind
+# of upload is built once and reused
+_MULTIPART_BOUNDARY = secrets.token_hex(16)
+_MULTIPART_HEADERS = {"Content-Type": f"multipart/form-data; boundary={_MULTIPART_BOUNDARY}"}
+
+# Whisper detects the language from the first 30 s of audio. Roughly the bytes
+# that takes per format: lossy codecs at 128 kbit/s, FLAC at ~60% of
+# CD-quality PCM, and WAV as CD-quality PCM
+DETECT_PREFIX_SIZES = {
+    "mp3": 30 * 128_000 // 8,
+    "ogg": 30 * 128_000 // 8,
+    "webm": 30 * 128_000 // 8,
+    "flac": 30 * 44_100 * 2 * 2 * 6 // 10,
+    "wav": 30 * 44_100 * 2 * 2,
+}
+# MP3 data read past the prefix to find the next frame boundary
+MP3_FRAME_SLACK = 4096
+
 # Initialize MCP server
 mcp = FastMCP(
     name="Whisper ASR",
@@ -93,6 +168,16 @@ class OutputFormat(str, Enum):
     TSV = "tsv"
 
 
+_OUTPUT_FORMATS = {f.value: f for f in OutputFormat}
+
+# Recent results keyed by (audio content key, output format), least recently
+# used first, so repeated requests for the same audio skip the backends
+_TRANSCRIPTION_CACHE: OrderedDict[tuple[str, OutputFormat], tuple[Any, Optional[str]]] = OrderedDict()
+
+# Output formats requested from whisper-asr as JSON, which reports the language
+_JSON_RESPONSE_FORMATS = (OutputFormat.TEXT, OutputFormat.JSON)
+
+
 class TranscriptionResult(BaseModel):
     """Result of audio transcription."""
     text: str
@@ -100,99 +185,443 @@ class TranscriptionResult(BaseModel):
     output_format: str
 
 
-# Audio formats that whisper-asr can handle directly (via its internal ffmpeg)
-# However, faster_whisper has issues with some formats, so we convert everything non-mp3
-MP3_SIGNATURES = [
-    b'\xff\xfb',  # MP3 frame sync
-    b'\xff\xfa',  # MP3 frame sync
-    b'\xff\xf3',  # MP3 frame sync
-    b'\xff\xf2',  # MP3 frame sync
-    b'ID3',       # ID3v2 tag
-]
+# Response header some whisper-asr deployments use to report the detected language
+LANGUAGE_HEADER = "X-Detected-Language"
 
 
-def is_mp3(audio_data: bytes) -> bool:
-    """Check if audio data is MP3 format based on magic bytes."""
-    for sig in MP3_SIGNATURES:
-        if audio_data.startswith(sig):
-            return True
-    return False
+# MP3 frame sync words (first two bytes of an MPEG audio frame)
+_MP3_PREFIXES = frozenset({
+    b'\xff\xfb',
+    b'\xff\xfa',
+    b'\xff\xf3',
+    b'\xff\xf2',
+})
+_ID3_TAG = b'ID3'  # ID3v2 tag in front of MP3 frames
 
+# Leading bytes needed to identify an audio format
+HEAD_SIZE = 16
 
-async def convert_to_mp3(audio_data: bytes, filename: str = "audio") -> bytes:
-    """Convert audio to MP3 using ffmpeg-api service."""
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        # Determine a reasonable filename extension for the input
-        files = {"file": (filename, audio_data)}
-        response = await client.post(
-            f"{FFMPEG_API_URL}/convert/audio/to/mp3",
-            files=files,
+# Other containers recognised by their first four bytes
+FORMAT_SIGNATURES = {
+    b'fLaC': "flac",
+    b'OggS': "ogg",
+    b'\x1aE\xdf\xa3': "webm",  # Matroska/WebM EBML header
+}
+# RIFF also wraps video and images (AVI, WebP, ...): only WAVE is audio
+_RIFF_TAG = b'RIFF'
+_WAVE_FORM = b'WAVE'
+
+# Audio formats that whisper-asr can handle directly (via its internal ffmpeg).
+# However, whisper-asr pipes uploads into ffmpeg, which cannot seek to the index
+# MP4/M4A files usually keep at the end, so those are converted to MP3 first,
+# as is anything we don't recognise.
+_NEEDS_CONVERSION = {"m4a", None}
+
+
+def is_mp3(head: bytes) -> bool:
+    """Check if audio is MP3 format based on the magic bytes at its start."""
+    return head[:2] in _MP3_PREFIXES or head[:3] == _ID3_TAG
+
+
+def detect_format(head: bytes) -> Optional[str]:
+    """
+    Identify the audio container from its first HEAD_SIZE bytes.
+
+    Returns None if the format is not recognised.
+    """
+    audio_format = FORMAT_SIGNATURES.get(head[:4])
+    if audio_format is not None:
+        return audio_format
+    if head[:4] == _RIFF_TAG:
+        return "wav" if head[8:12] == _WAVE_FORM else None
+    if is_mp3(head):
+        return "mp3"
+    if head[4:8] == b"ftyp":  # MP4 family (m4a, mp4, mov)
+        return "m4a"
+    return None
+
+
+def _backend_transport(max_connections: int) -> httpx.AsyncHTTPTransport:
+    """
+    Create a pooled transport for a backend service.
+
+    HTTP/2 is negotiated over TLS when the service offers it; plain http://
+    URLs stay on HTTP/1.1 keep-alive. Failed connection attempts are retried once.
+    """
+    return httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=1,
+        limits=httpx.Limits(
+            max_keepalive_connections=max_connections,
+            max_connections=max_connections,
+            keepalive_expiry=30,
+        ),
+    )
+
+
+async def _get_whisper_client() -> httpx.AsyncClient:
+    """Return the shared whisper-asr client, creating it on first use."""
+    global _WHISPER_CLIENT
+    async with _CLIENT_LOCK:
+        if _WHISPER_CLIENT is None:
+            _WHISPER_CLIENT = httpx.AsyncClient(
+                base_url=WHISPER_ASR_URL,
+                timeout=httpx.Timeout(600.0, connect=10.0),
+                transport=_backend_transport(ASR_CONCURRENCY),
+            )
+        return _WHISPER_CLIENT
+
+
+async def _get_ffmpeg_client() -> httpx.AsyncClient:
+    """Return the shared ffmpeg-api client, creating it on first use."""
+    global _FFMPEG_CLIENT
+    async with _CLIENT_LOCK:
+        if _FFMPEG_CLIENT is None:
+            _FFMPEG_CLIENT = httpx.AsyncClient(
+                base_url=FFMPEG_API_URL,
+                timeout=httpx.Timeout(300.0, connect=10.0),
+                transport=_backend_transport(FFMPEG_CONCURRENCY),
+            )
+        return _FFMPEG_CLIENT
+
+
+async def _get_fetch_client() -> httpx.AsyncClient:
+    """Return the shared client used to download audio from URLs."""
+    global _FETCH_CLIENT
+    async with _CLIENT_LOCK:
+        if _FETCH_CLIENT is None:
+            _FETCH_CLIENT = httpx.AsyncClient(
+                timeout=httpx.Timeout(120.0, connect=10.0),
+                limits=_CLIENT_LIMITS,
+                http2=True,
+                follow_redirects=True,
+            )
+        return _FETCH_CLIENT
+
+
+async def close_clients() -> None:
+    """Close the shared HTTP clients and release their pooled connections."""
+    global _WHISPER_CLIENT, _FFMPEG_CLIENT, _FETCH_CLIENT
+    async with _CLIENT_LOCK:
+        for client in (_WHISPER_CLIENT, _FFMPEG_CLIENT, _FETCH_CLIENT):
+            if client is not None:
+                await client.aclose()
+        _WHISPER_CLIENT = _FFMPEG_CLIENT = _FETCH_CLIENT = None
+
+
+def _spooled_file() -> IO[bytes]:
+    """Create a temporary file that stays in memory until it grows large."""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+
+async def _iter_file(audio: IO[bytes]) -> AsyncIterator[bytes]:
+    """
+    Yield the whole content of a file in chunks, starting from the top.
+
+    Reads happen in a worker thread so disk I/O doesn't stall the event loop.
+    """
+    audio.seek(0)
+    while chunk := await asyncio.to_thread(audio.read, CHUNK_SIZE):
+        yield chunk
+
+
+def _stream_b64_decode(b64: str, sink: IO[bytes], digest: Any = None) -> None:
+    """
+    Decode base64 text into sink one slice at a time.
+
+    Characters outside the base64 alphabet are dropped, as base64.b64decode
+    does, and any partial 4-character group is carried over, so each slice
+    decodes on its own. The decoded audio is also fed to digest, if given.
+    """
+    pending = ""
+    for start in range(0, len(b64), B64_CHUNK_SIZE):
+        piece = pending + _B64_IGNORED.sub("", b64[start:start + B64_CHUNK_SIZE])
+        usable = len(piece) - len(piece) % 4
+        chunk = base64.b64decode(piece[:usable], validate=False)
+        if digest is not None:
+            digest.update(chunk)
+        sink.write(chunk)
+        pending = piece[usable:]
+    if pending:
+        # Incomplete trailing group: fails with the usual padding error
+        chunk = base64.b64decode(pending, validate=False)
+        if digest is not None:
+            digest.update(chunk)
+        sink.write(chunk)
+
+
+def _path_cache_key(path: str, st: os.stat_result, first_block: bytes) -> str:
+    """Identify a local file by path, size, mtime and a hash of its first 4 KiB."""
+    head_digest = content_hash(first_block).hexdigest()
+    return f"path:{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}:{head_digest}"
+
+
+def _cache_get(key: tuple[str, OutputFormat]) -> Optional[tuple[Any, Optional[str]]]:
+    """Return a cached transcription and language, marking it recently used."""
+    result = _TRANSCRIPTION_CACHE.get(key)
+    if result is not None:
+        _TRANSCRIPTION_CACHE.move_to_end(key)
+    return result
+
+
+def _cache_put(key: tuple[str, OutputFormat], result: tuple[Any, Optional[str]]) -> None:
+    """Store a transcription, evicting the least recently used beyond the limit."""
+    if TRANSCRIPTION_CACHE_SIZE <= 0:
+        return
+    _TRANSCRIPTION_CACHE[key] = result
+    _TRANSCRIPTION_CACHE.move_to_end(key)
+    while len(_TRANSCRIPTION_CACHE) > TRANSCRIPTION_CACHE_SIZE:
+        _TRANSCRIPTION_CACHE.popitem(last=False)
+
+
+def _read_prefix(audio: IO[bytes], size: int) -> bytes:
+    """Read the first size bytes of a file."""
+    audio.seek(0)
+    return audio.read(size)
+
+
+def _file_size(audio: IO[bytes]) -> int:
+    """Return the size of a seekable file without reading it."""
+    return audio.seek(0, os.SEEK_END)
+
+
+async def _iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+    """Yield in-memory data as a single chunk."""
+    yield data
+
+
+async def _tee_prefix(
+    chunks: AsyncIterable[bytes], size: int, prefix: asyncio.Future
+) -> AsyncIterator[bytes]:
+    """Pass chunks through unchanged, resolving prefix with the first size bytes."""
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            if not prefix.done():
+                buffer += chunk
+                if len(buffer) >= size:
+                    prefix.set_result(bytes(buffer[:size]))
+            yield chunk
+    finally:
+        # Shorter audio: the whole of it is the prefix
+        if not prefix.done():
+            prefix.set_result(bytes(buffer))
+
+
+def _detect_capture_size(audio_format: str) -> int:
+    """Bytes to take from the start of the audio for language detection."""
+    size = DETECT_PREFIX_SIZES[audio_format]
+    if audio_format == "mp3":
+        size += MP3_FRAME_SLACK
+    return size
+
+
+def _cut_mp3_prefix(audio_data: bytes, size: int) -> bytes:
+    """Cut MP3 data at the first frame boundary at or after size bytes."""
+    pos = audio_data.find(b"\xff", size)
+    while pos != -1 and audio_data[pos:pos + 2] not in _MP3_PREFIXES:
+        pos = audio_data.find(b"\xff", pos + 1)
+    return audio_data[:size if pos == -1 else pos]
+
+
+def _quote_form_param(value: str) -> str:
+    """Escape a multipart header parameter the way browsers (and httpx) do."""
+    value = value.replace("\\", "\\\\").replace('"', "%22")
+    return re.sub(r"[\x00-\x1f]", lambda m: f"%{ord(m.group()):02X}", value)
+
+
+@functools.lru_cache(maxsize=64)
+def _multipart_envelope(field: str, filename: str, content_type: str) -> tuple[bytes, bytes]:
+    """Return the bytes framing a single file field, before and after its content."""
+    head = (
+        f"--{_MULTIPART_BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; '
+        f'filename="{_quote_form_param(filename)}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{_MULTIPART_BOUNDARY}--\r\n".encode()
+    return head, tail
+
+
+def _multipart_upload(
+    field: str,
+    filename: str,
+    content_type: str,
+    chunks: AsyncIterable[bytes],
+    size: Optional[int] = None,
+) -> tuple[dict[str, str], AsyncIterator[bytes]]:
+    """
+    Build a streamed multipart/form-data body holding a single file field.
+
+    httpx's own encoder only takes whole files, reads them synchronously and
+    probes their length with fileno(), which forces spooled temporary files
+    onto disk, so the envelope is written here and the file content is
+    streamed between its two halves as chunks become available.
+
+    When the content size is known the body is sent with a Content-Length
+    instead of chunked transfer encoding.
+    """
+    head, tail = _multipart_envelope(field, filename, content_type)
+    headers = _MULTIPART_HEADERS
+    if size is not None:
+        headers = {**headers, "Content-Length": str(len(head) + size + len(tail))}
+
+    async def body() -> AsyncIterator[bytes]:
+        yield head
+        async for chunk in chunks:
+            yield chunk
+        yield tail
+
+    return headers, body()
+
+
+@contextlib.asynccontextmanager
+async def convert_to_mp3(
+    audio: IO[bytes], filename: str = "audio"
+) -> AsyncIterator[AsyncIterator[bytes]]:
+    """
+    Convert audio to MP3 using ffmpeg-api service.
+
+    Yields the MP3 data as it arrives, so it can be forwarded to whisper-asr
+    while ffmpeg-api is still sending it. The response and the conversion
+    permit are released as soon as the MP3 data has been read to the end.
+    """
+    client = await _get_ffmpeg_client()
+    # Pass the original filename so the service can tell the input format
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers, body = _multipart_upload(
+        "file", filename, content_type, _iter_file(audio), _file_size(audio)
+    )
+    async with contextlib.AsyncExitStack() as conversion:
+        await conversion.enter_async_context(_FFMPEG_SEMAPHORE)
+        response = await conversion.enter_async_context(
+            client.stream("POST", "/convert/audio/to/mp3", content=body, headers=headers)
         )
         response.raise_for_status()
-        return response.content
 
+        async def mp3_data() -> AsyncIterator[bytes]:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+            await conversion.aclose()
+
+        yield mp3_data()
 
-async def detect_language(audio_data: bytes) -> Optional[str]:
+
+async def detect_language(
+    audio: AsyncIterable[bytes],
+    filename: str = "audio.mp3",
+    size: Optional[int] = None,
+) -> Optional[str]:
     """Detect language of audio using whisper-asr service."""
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        files = {"audio_file": ("audio.mp3", audio_data, "audio/mpeg")}
+    client = await _get_whisper_client()
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers, body = _multipart_upload("audio_file", filename, content_type, audio, size)
+    async with _ASR_SEMAPHORE:
         response = await client.post(
-            f"{WHISPER_ASR_URL}/detect-language",
-            files=files,
+            "/detect-language", content=body, headers=headers, timeout=120.0
         )
-        if response.status_code == 200:
-            result = response.json()
-            # Response format: {"detected_language": "en", "language_code": "en"}
-            return result.get("language_code") or result.get("detected_language")
+    if response.status_code == 200:
+        result = response.json()
+        # Response format: {"detected_language": "en", "language_code": "en"}
+        return result.get("language_code") or result.get("detected_language")
+    return None
+
+
+async def _detect_prefix_language(
+    prefix: Awaitable[bytes], audio_format: str, filename: str
+) -> Optional[str]:
+    """Detect the language from the start of the audio once it has been read."""
+    audio_data = await prefix
+    if audio_format == "mp3":
+        audio_data = _cut_mp3_prefix(audio_data, DETECT_PREFIX_SIZES["mp3"])
+    try:
+        return await detect_language(_iter_bytes(audio_data), filename, len(audio_data))
+    except Exception:
+        # Language detection failed, proceed without it
         return None
 
 
 async def transcribe_audio_data(
-    audio_data: bytes,
+    audio: AsyncIterable[bytes],
     language: Optional[str] = None,
     output_format: OutputFormat = OutputFormat.TEXT,
-) -> str:
-    """Transcribe audio using whisper-asr service."""
-    async with httpx.AsyncClient(timeout=600.0) as client:
-        files = {"audio_file": ("audio.mp3", audio_data, "audio/mpeg")}
-        params = {"output": output_format.value}
-        if language:
-            params["language"] = language
-
-        response = await client.post(
-            f"{WHISPER_ASR_URL}/asr",
-            files=files,
-            params=params,
-        )
-        response.raise_for_status()
-
-        # Return based on output format
-        if output_format == OutputFormat.JSON:
-            return response.text  # Already JSON string
-        return response.text
-
-
-async def fetch_audio_from_url(url: str) -> tuple[bytes, str]:
-    """Fetch audio from URL, return data and filename."""
-    async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as client:
-        response = await client.get(url)
-        response.raise_for_status()
+    filename: str = "audio.mp3",
+    size: Optional[int] = None,
+) -> tuple[Union[str, dict], Optional[str]]:
+    """
+    Transcribe audio using whisper-asr service.
 
-        # Try to get filename from URL or content-disposition
-        filename = url.split("/")[-1].split("?")[0] or "audio"
-        if "content-disposition" in response.headers:
-            cd = response.headers["content-disposition"]
-            if "filename=" in cd:
-                filename = cd.split("filename=")[-1].strip('"\'')
+    Returns the transcription and the language whisper-asr detected, if the
+    response reports it. JSON output is returned parsed, other formats as text.
+    Plain text is rendered from the JSON output so that the detected language
+    comes back with the same request.
+    """
+    client = await _get_whisper_client()
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers, body = _multipart_upload("audio_file", filename, content_type, audio, size)
+    if output_format in _JSON_RESPONSE_FORMATS:
+        request_format = OutputFormat.JSON
+    else:
+        request_format = output_format
+    params = {"output": request_format.value}
+    if language:
+        params["language"] = language
+
+    async with _ASR_SEMAPHORE:
+        response = await client.post("/asr", content=body, headers=headers, params=params)
+    response.raise_for_status()
+
+    detected_language = response.headers.get(LANGUAGE_HEADER)
+    if request_format != OutputFormat.JSON:
+        return response.content.decode("utf-8"), detected_language
+
+    result = _json_loads(response.content)
+    detected_language = detected_language or result.get("language")
+    if output_format == OutputFormat.TEXT:
+        # Same layout as whisper's text writer: one stripped segment per line
+        segments = result.get("segments") or []
+        text = "".join(f"{segment['text'].strip()}\n" for segment in segments)
+        return text, detected_language
+    return result, detected_language
+
+
+async def fetch_audio_from_url(url: str, digest: Any = None) -> tuple[IO[bytes], str]:
+    """
+    Download audio from URL into a temporary file, return it and the filename.
 
-        return response.content, filename
+    The downloaded audio is also fed to digest, if given.
+    """
+    client = await _get_fetch_client()
+    audio = _spooled_file()
+    try:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                if digest is not None:
+                    digest.update(chunk)
+                await asyncio.to_thread(audio.write, chunk)
+    except BaseException:
+        audio.close()
+        raise
+
+    # Try to get filename from URL or content-disposition
+    filename = url.split("/")[-1].split("?")[0] or "audio"
+    if "content-disposition" in response.headers:
+        cd = response.headers["content-disposition"]
+        if "filename=" in cd:
+            filename = cd.split("filename=")[-1].strip('"\'')
+
+    return audio, filename
 
 
 @mcp.tool()
 async def transcribe(
     audio_base64: Optional[str] = Field(
         default=None,
-        description="Base64-encoded audio data. Provide either this, audio_url, or audio_path.",
+        description=(
+            "Base64-encoded audio data. Provide either this, audio_url, or audio_path. "
+            "Prefer audio_path or audio_url when possible."
+        ),
     ),
     audio_url: Optional[str] = Field(
         default=None,
@@ -214,65 +643,135 @@ async def transcribe(
     """
     Transcribe audio to text with automatic format conversion and language detection.
 
-    Accepts audio in any format supported by ffmpeg. Non-MP3 files are automatically
-    converted to MP3 before transcription. Language is auto-detected and used for
-    optimal transcription accuracy.
+    Accepts audio in any format supported by ffmpeg. MP3, WAV, FLAC, Ogg and WebM
+    are sent as-is; other files are automatically converted to MP3 before
+    transcription. Language is auto-detected by whisper-asr
+    during transcription.
 
     Returns transcription in the requested format (text, json, vtt, srt, or tsv).
     """
     # Validate input - exactly one source must be provided
-    sources = [audio_base64, audio_url, audio_path]
-    provided_sources = sum(1 for s in sources if s)
-
-    if provided_sources == 0:
-        return {"error": "Provide one of: audio_base64, audio_url, or audio_path"}
-
-    if provided_sources > 1:
-        return {"error": "Provide only one of: audio_base64, audio_url, or audio_path"}
+    if bool(audio_base64) + bool(audio_url) + bool(audio_path) != 1:
+        return {"error": "Provide exactly one of: audio_base64, audio_url, or audio_path"}
 
     # Parse output format
-    try:
-        fmt = OutputFormat(output_format.lower())
-    except ValueError:
-        return {"error": f"Invalid output_format. Choose from: {[f.value for f in OutputFormat]}"}
-
-    # Get audio data
-    try:
-        if audio_base64:
-            audio_data = base64.b64decode(audio_base64)
-            filename = filename or "audio"
-        elif audio_path:
-            if not os.path.exists(audio_path):
-                return {"error": f"File not found: {audio_path}"}
-            with open(audio_path, "rb") as f:
-                audio_data = f.read()
-            filename = filename or os.path.basename(audio_path)
-        else:
-            audio_data, detected_filename = await fetch_audio_from_url(audio_url)
-            filename = filename or detected_filename
-    except Exception as e:
-        return {"error": f"Failed to get audio data: {str(e)}"}
-
-    # Convert to MP3 if needed
-    try:
-        if not is_mp3(audio_data):
-            audio_data = await convert_to_mp3(audio_data, filename)
-    except Exception as e:
-        return {"error": f"Failed to convert audio to MP3: {str(e)}"}
-
-    # Detect language
-    detected_language = None
-    try:
-        detected_language = await detect_language(audio_data)
-    except Exception:
-        # Language detection failed, proceed without it
-        pass
-
-    # Transcribe
-    try:
-        transcription = await transcribe_audio_data(audio_data, detected_language, fmt)
-    except Exception as e:
-        return {"error": f"Transcription failed: {str(e)}"}
+    fmt = _OUTPUT_FORMATS.get(output_format.lower())
+    if fmt is None:
+        return {"error": f"Invalid output_format. Choose from: {list(_OUTPUT_FORMATS)}"}
+
+    async with contextlib.AsyncExitStack() as resources:
+        # Key for the transcription cache, skipped entirely when it's disabled
+        use_cache = TRANSCRIPTION_CACHE_SIZE > 0
+        digest = content_hash() if use_cache else None
+        content_key = None
+
+        # Get audio data
+        try:
+            if audio_base64:
+                audio = resources.enter_context(_spooled_file())
+                await asyncio.to_thread(_stream_b64_decode, audio_base64, audio, digest)
+                if use_cache:
+                    content_key = f"content:{digest.hexdigest()}"
+                head = _read_prefix(audio, HEAD_SIZE)
+                filename = filename or "audio"
+            elif audio_path:
+                try:
+                    audio = resources.enter_context(open(audio_path, "rb"))
+                except FileNotFoundError:
+                    return {"error": f"File not found: {audio_path}"}
+                st = os.fstat(audio.fileno())
+                if st.st_size > LARGE_FILE_SIZE and hasattr(os, "posix_fadvise"):
+                    # Read ahead more aggressively for the sequential upload
+                    os.posix_fadvise(audio.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                if use_cache:
+                    first_block = audio.read(4096)
+                    content_key = _path_cache_key(audio_path, st, first_block)
+                    head = first_block[:HEAD_SIZE]
+                else:
+                    head = audio.read(HEAD_SIZE)
+                filename = filename or os.path.basename(audio_path)
+            else:
+                audio, detected_filename = await fetch_audio_from_url(audio_url, digest)
+                resources.enter_context(audio)
+                if use_cache:
+                    content_key = f"content:{digest.hexdigest()}"
+                head = _read_prefix(audio, HEAD_SIZE)
+                filename = filename or detected_filename
+        except Exception as e:
+            return {"error": f"Failed to get audio data: {str(e)}"}
+
+        # Reuse an earlier transcription of the same audio
+        cache_key = (content_key, fmt)
+        cached = _cache_get(cache_key) if use_cache else None
+        if cached is not None:
+            transcription, detected_language = cached
+            return {
+                "transcription": transcription,
+                "detected_language": detected_language,
+                "output_format": fmt.value,
+            }
+
+        # Convert to MP3 if whisper-asr can't read the format directly. The
+        # converted audio is streamed straight into the transcription request.
+        try:
+            audio_format = detect_format(head)
+            if audio_format in _NEEDS_CONVERSION:
+                chunks = await resources.enter_async_context(convert_to_mp3(audio, filename))
+                audio_format = "mp3"
+                size = None  # Streamed as ffmpeg-api produces it
+                piped = True
+                if _ASR_SEMAPHORE.locked():
+                    # whisper-asr is busy: take the converted audio now so the
+                    # ffmpeg-api response and permit aren't held while queueing
+                    audio = resources.enter_context(_spooled_file())
+                    async for chunk in chunks:
+                        await asyncio.to_thread(audio.write, chunk)
+                    chunks = _iter_file(audio)
+                    size = _file_size(audio)
+                    piped = False
+            else:
+                chunks = _iter_file(audio)
+                size = _file_size(audio)
+                piped = False
+        except Exception as e:
+            return {"error": f"Failed to convert audio to MP3: {str(e)}"}
+        upload_name = f"audio.{audio_format}"
+
+        # Formats that whisper-asr can't report the language with get a
+        # detection request on the first seconds of audio, captured as they
+        # are uploaded and sent while the transcription is still running
+        detection = None
+        if fmt not in _JSON_RESPONSE_FORMATS:
+            prefix = asyncio.get_running_loop().create_future()
+            chunks = _tee_prefix(chunks, _detect_capture_size(audio_format), prefix)
+            detection = asyncio.create_task(
+                _detect_prefix_language(prefix, audio_format, upload_name)
+            )
+            resources.callback(detection.cancel)
+
+        # Transcribe, letting whisper-asr detect the language in the same pass
+        try:
+            transcription, detected_language = await transcribe_audio_data(
+                chunks, output_format=fmt, filename=upload_name, size=size
+            )
+        except Exception as e:
+            return {"error": f"Transcription failed: {str(e)}"}
+
+        # Fall back to a separate detection if the response didn't report it.
+        # Audio piped from ffmpeg-api can't be read again, so it goes without.
+        if detected_language is None:
+            if detection is not None:
+                detected_language = await detection
+            elif not piped:
+                prefix = asyncio.to_thread(
+                    _read_prefix, audio, _detect_capture_size(audio_format)
+                )
+                detected_language = await _detect_prefix_language(
+                    prefix, audio_format, upload_name
+                )
+
+        if use_cache:
+            _cache_put(cache_key, (transcription, detected_language))
 
     return {
         "transcription": transcription,
@@ -281,6 +780,20 @@ async def transcribe(
     }
 
 
+async def main() -> None:
+    """Serve over Streamable HTTP and close pooled connections on shutdown."""
+    try:
+        # Single POST endpoint at /mcp
+        await mcp.run_streamable_http_async()
+    finally:
+        await close_clients()
+
+
 if __name__ == "__main__":
-    # Run with Streamable HTTP transport (single POST endpoint at /mcp)
-    mcp.run(transport="streamable-http")
+    try:
+        # libuv-based event loop with lower per-await overhead
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -0,0 +1,431 @@
+"""Offline tests for the streaming helpers in the server module."""
+
+import asyncio
+import base64 as stdlib_base64
+import binascii
+import hashlib
+import os
+import random
+from collections import OrderedDict
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+from src import server
+
+
+async def _collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+class FakeBackend:
+    """MockTransport handler that records requests and answers with respond()."""
+
+    def __init__(self):
+        self.requests: list[httpx.Request] = []
+        self.respond = lambda request: httpx.Response(404)
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        self.requests.append(request)
+        return self.respond(request)
+
+
+@pytest.fixture
+def whisper(monkeypatch) -> FakeBackend:
+    """Route whisper-asr requests to a fake backend."""
+    backend = FakeBackend()
+    client = httpx.AsyncClient(base_url="http://whisper-asr", transport=httpx.MockTransport(backend))
+    monkeypatch.setattr(server, "_WHISPER_CLIENT", client)
+    monkeypatch.setattr(server, "_ASR_SEMAPHORE", asyncio.Semaphore(1))
+    return backend
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch) -> FakeBackend:
+    """Route ffmpeg-api requests to a fake backend allowing one conversion at a time."""
+    backend = FakeBackend()
+    client = httpx.AsyncClient(base_url="http://ffmpeg-api", transport=httpx.MockTransport(backend))
+    monkeypatch.setattr(server, "_FFMPEG_CLIENT", client)
+    monkeypatch.setattr(server, "_FFMPEG_SEMAPHORE", asyncio.Semaphore(1))
+    return backend
+
+
+@pytest.fixture
+def cache(monkeypatch) -> OrderedDict:
+    """Give each test an empty transcription cache."""
+    monkeypatch.setattr(server, "_TRANSCRIPTION_CACHE", OrderedDict())
+    monkeypatch.setattr(server, "TRANSCRIPTION_CACHE_SIZE", 32)
+    return server._TRANSCRIPTION_CACHE
+
+
+# Tool arguments as MCP fills them in when the client leaves them out
+TRANSCRIBE_DEFAULTS = {
+    "audio_base64": None,
+    "audio_url": None,
+    "audio_path": None,
+    "output_format": "text",
+    "filename": None,
+}
+
+
+def _transcribe(**kwargs) -> dict:
+    return asyncio.run(server.transcribe(**{**TRANSCRIBE_DEFAULTS, **kwargs}))
+
+
+def _transcribe_data(output_format: server.OutputFormat):
+    return asyncio.run(
+        server.transcribe_audio_data(server._iter_bytes(b"audio"), output_format=output_format, size=5)
+    )
+
+
+
+def _decode(b64: str) -> bytes:
+    sink = server._spooled_file()
+    server._stream_b64_decode(b64, sink)
+    sink.seek(0)
+    return sink.read()
+
+
+@pytest.mark.parametrize(
+    "size",
+    [0, 1, 2, 3, 1000, server.B64_CHUNK_SIZE // 4 * 3, server.B64_CHUNK_SIZE + 7, 3 * server.B64_CHUNK_SIZE + 1],
+)
+def test_stream_b64_decode_matches_stdlib(size):
+    data = random.Random(size).randbytes(size)
+    b64 = stdlib_base64.b64encode(data).decode()
+    assert _decode(b64) == stdlib_base64.b64decode(b64) == data
+
+
+def test_stream_b64_decode_ignores_whitespace_across_slices():
+    data = random.Random(1).randbytes(2 * server.B64_CHUNK_SIZE)
+    wrapped = stdlib_base64.encodebytes(data).decode()  # 76-char lines
+    encoded = stdlib_base64.b64encode(data).decode()
+    spaced = " ".join(encoded[i:i + 5] for i in range(0, len(encoded), 5))
+    assert _decode(wrapped) == data
+    assert _decode(spaced) == stdlib_base64.b64decode(spaced)
+
+
+def test_stream_b64_decode_ignores_non_alphabet_characters():
+    data = random.Random(3).randbytes(2 * server.B64_CHUNK_SIZE)
+    encoded = stdlib_base64.b64encode(data).decode()
+    # Stray characters on both sides of the slice boundaries
+    junk = "".join(
+        encoded[i:i + 1001] + "\x00!*"[i % 3] for i in range(0, len(encoded), 1001)
+    )
+    assert _decode(junk) == stdlib_base64.b64decode(junk) == data
+    data_uri = "data:audio/mpeg;base64," + encoded
+    assert _decode(data_uri) == stdlib_base64.b64decode(data_uri)
+
+
+def test_stream_b64_decode_feeds_digest():
+    data = random.Random(2).randbytes(server.B64_CHUNK_SIZE + 123)
+    digest = hashlib.sha256()
+    server._stream_b64_decode(stdlib_base64.b64encode(data).decode(), server._spooled_file(), digest)
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_stream_b64_decode_rejects_truncated_input():
+    with pytest.raises(binascii.Error):
+        _decode("QUJDRA")
+
+
+def test_cut_mp3_prefix_stops_at_next_frame_sync():
+    frame = b"\xff\xfb" + b"\x00" * 10
+    data = frame + b"\xff\x00" + frame + frame
+    # Bare 0xff bytes are not frame boundaries
+    assert server._cut_mp3_prefix(data, 3) == frame + b"\xff\x00"
+    assert server._cut_mp3_prefix(data, len(frame) + 2) == frame + b"\xff\x00"
+    assert server._cut_mp3_prefix(data, len(frame) + 3) == frame + b"\xff\x00" + frame
+
+
+def test_cut_mp3_prefix_without_sync_word():
+    assert server._cut_mp3_prefix(b"\x00" * 100, 40) == b"\x00" * 40
+    assert server._cut_mp3_prefix(b"\xff\xfb\x00", 40) == b"\xff\xfb\x00"
+
+
+def test_tee_prefix_is_capped_and_passes_chunks_through():
+    async def run():
+        prefix = asyncio.get_running_loop().create_future()
+        chunks = [b"a" * 700, b"b" * 700, b"c" * 700]
+
+        async def source():
+            for chunk in chunks:
+                yield chunk
+
+        passed = await _collect(server._tee_prefix(source(), 1000, prefix))
+        return passed, prefix.result()
+
+    passed, prefix = asyncio.run(run())
+    assert passed == b"a" * 700 + b"b" * 700 + b"c" * 700
+    assert prefix == b"a" * 700 + b"b" * 300
+
+
+async def _parse_form(headers: dict[str, str], payload: bytes):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    form = await Request(scope, receive).form()
+    upload = form["audio_file"]
+    return upload.filename, upload.content_type, await upload.read()
+
+
+@pytest.mark.parametrize(
+    "filename, parsed_filename",
+    [
+        ("audio.mp3", "audio.mp3"),
+        ('we"ird\\name\n.mp3', "we%22ird\\name%0A.mp3"),
+    ],
+)
+def test_multipart_upload_round_trips(filename, parsed_filename):
+    data = bytes(range(256)) * 4096
+    headers, body = server._multipart_upload(
+        "audio_file", filename, "audio/mpeg", server._iter_bytes(data)
+    )
+    payload = asyncio.run(_collect(body))
+    assert "Content-Length" not in headers
+    assert asyncio.run(_parse_form(headers, payload)) == (parsed_filename, "audio/mpeg", data)
+
+
+@pytest.mark.parametrize("filename", ["audio.mp3", 'we"ird\\name\n.mp3'])
+def test_multipart_upload_content_length_matches_body(filename):
+    data = b"\xff\xfb" + bytes(range(256)) * 1000
+    headers, body = server._multipart_upload(
+        "audio_file", filename, "audio/mpeg", server._iter_bytes(data), len(data)
+    )
+    payload = asyncio.run(_collect(body))
+    assert int(headers["Content-Length"]) == len(payload)
+    assert asyncio.run(_parse_form(headers, payload))[2] == data
+
+
+@pytest.mark.parametrize(
+    "head, audio_format",
+    [
+        (b"ID3\x04\x00\x00\x00\x00\x00\x00", "mp3"),
+        *[(sync + b"\x90\x64\x00\x00", "mp3") for sync in sorted(server._MP3_PREFIXES)],
+        (b"RIFF\x24\x08\x00\x00WAVEfmt ", "wav"),
+        (b"RIFF\x24\x08\x00\x00AVI LIST", None),
+        (b"RIFF\x24\x08\x00\x00WEBPVP8 ", None),
+        (b"fLaC\x00\x00\x00\x22", "flac"),
+        (b"OggS\x00\x02\x00\x00", "ogg"),
+        (b"\x1aE\xdf\xa3\x9fB\x86\x81", "webm"),
+        (b"\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00", "m4a"),
+        (b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00", "m4a"),
+        (b"\xff\xf1\x50\x80", None),  # ADTS AAC, not an MPEG audio layer 3 sync word
+        (b"", None),
+    ],
+)
+def test_detect_format(head, audio_format):
+    assert server.detect_format(head[:server.HEAD_SIZE]) == audio_format
+
+
+@pytest.mark.parametrize(
+    "head, expected",
+    [
+        (b"ID3\x03", True),
+        (b"\xff\xfb\x90", True),
+        (b"\xff\xfa\x90", True),
+        (b"\xff\xf3\x90", True),
+        (b"\xff\xf2\x90", True),
+        (b"\xff\xf1\x50", False),
+        (b"RIFF", False),
+        (b"\xff", False),
+    ],
+)
+def test_is_mp3(head, expected):
+    assert server.is_mp3(head) is expected
+
+
+ASR_JSON = {
+    "text": " Hello there. General Kenobi.",
+    "language": "en",
+    "segments": [{"text": " Hello there. "}, {"text": " General Kenobi."}],
+}
+
+
+@pytest.mark.parametrize("output_format", [server.OutputFormat.TEXT, server.OutputFormat.JSON])
+def test_transcribe_audio_data_requests_json(whisper, output_format):
+    whisper.respond = lambda request: httpx.Response(200, json=ASR_JSON)
+    _transcribe_data(output_format)
+    (request,) = whisper.requests
+    assert request.url.path == "/asr"
+    assert request.url.params["output"] == "json"
+
+
+def test_transcribe_audio_data_renders_text_per_segment(whisper):
+    whisper.respond = lambda request: httpx.Response(200, json=ASR_JSON)
+    assert _transcribe_data(server.OutputFormat.TEXT) == ("Hello there.\nGeneral Kenobi.\n", "en")
+
+
+def test_transcribe_audio_data_returns_json_parsed(whisper):
+    whisper.respond = lambda request: httpx.Response(200, json=ASR_JSON)
+    assert _transcribe_data(server.OutputFormat.JSON) == (ASR_JSON, "en")
+
+
+def test_transcribe_audio_data_prefers_language_header(whisper):
+    whisper.respond = lambda request: httpx.Response(
+        200, json=ASR_JSON, headers={server.LANGUAGE_HEADER: "de"}
+    )
+    assert _transcribe_data(server.OutputFormat.TEXT)[1] == "de"
+
+
+def test_transcribe_audio_data_passes_subtitles_through(whisper):
+    vtt = "WEBVTT\n\n00:00.000 --> 00:01.000\nHello there.\n"
+    whisper.respond = lambda request: httpx.Response(200, text=vtt)
+    assert _transcribe_data(server.OutputFormat.VTT) == (vtt, None)
+    assert whisper.requests[0].url.params["output"] == "vtt"
+
+
+MP3_DATA = (b"\xff\xfb\x90\x64" + bytes(range(256)) * 16) * 4
+
+
+@pytest.fixture
+def mp3_file(tmp_path):
+    path = tmp_path / "speech.mp3"
+    path.write_bytes(MP3_DATA)
+    return path
+
+
+def _asr_ok(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json=ASR_JSON)
+
+
+def test_cache_evicts_least_recently_used(cache, monkeypatch):
+    monkeypatch.setattr(server, "TRANSCRIPTION_CACHE_SIZE", 2)
+    a, b, c = (("content:" + name, server.OutputFormat.TEXT) for name in "abc")
+    server._cache_put(a, ("A", "en"))
+    server._cache_put(b, ("B", "en"))
+    assert server._cache_get(a) == ("A", "en")  # a is now the most recent
+    server._cache_put(c, ("C", "en"))
+    assert list(cache) == [a, c]
+    assert server._cache_get(b) is None
+
+
+def test_cache_disabled(cache, monkeypatch, whisper, mp3_file):
+    monkeypatch.setattr(server, "TRANSCRIPTION_CACHE_SIZE", 0)
+    whisper.respond = _asr_ok
+    for _ in range(2):
+        assert _transcribe(audio_path=str(mp3_file))["transcription"] == "Hello there.\nGeneral Kenobi.\n"
+    assert len(whisper.requests) == 2
+    assert not cache
+
+
+def test_repeated_path_is_served_from_cache(cache, whisper, mp3_file):
+    whisper.respond = _asr_ok
+    first = _transcribe(audio_path=str(mp3_file))
+    assert _transcribe(audio_path=str(mp3_file)) == first
+    assert len(whisper.requests) == 1
+    # Output formats are cached separately
+    assert _transcribe(audio_path=str(mp3_file), output_format="json")["transcription"] == ASR_JSON
+    assert len(whisper.requests) == 2
+
+
+def test_repeated_base64_is_served_from_cache(cache, whisper):
+    whisper.respond = _asr_ok
+    audio_base64 = stdlib_base64.b64encode(MP3_DATA).decode()
+    first = _transcribe(audio_base64=audio_base64)
+    assert _transcribe(audio_base64=stdlib_base64.encodebytes(MP3_DATA).decode()) == first
+    assert len(whisper.requests) == 1
+
+
+def _rewrite_first_block(path):
+    st = path.stat()
+    path.write_bytes(b"ID3" + MP3_DATA[3:])
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _touch(path):
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def _append(path):
+    st = path.stat()
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 100)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+@pytest.mark.parametrize("modify", [_rewrite_first_block, _touch, _append])
+def test_modified_path_misses_cache(cache, whisper, mp3_file, modify):
+    whisper.respond = _asr_ok
+    _transcribe(audio_path=str(mp3_file))
+    modify(mp3_file)
+    _transcribe(audio_path=str(mp3_file))
+    assert len(whisper.requests) == 2
+
+
+M4A_DATA = b"\x00\x00\x00\x20ftypM4A " + bytes(1000)
+
+
+@pytest.fixture
+def m4a_file(tmp_path):
+    path = tmp_path / "memo.m4a"
+    path.write_bytes(M4A_DATA)
+    return path
+
+
+def _convert_ok(request: httpx.Request) -> httpx.Response:
+    assert request.url.path == "/convert/audio/to/mp3"
+    return httpx.Response(200, content=MP3_DATA)
+
+
+def test_ffmpeg_permit_released_once_conversion_is_read(cache, whisper, ffmpeg, m4a_file):
+    permit_held = []
+
+    def asr_fails(request):
+        # The converted audio has been uploaded in full by now
+        permit_held.append(server._FFMPEG_SEMAPHORE.locked())
+        return httpx.Response(500)
+
+    ffmpeg.respond = _convert_ok
+    whisper.respond = asr_fails
+    assert "Transcription failed" in _transcribe(audio_path=str(m4a_file))["error"]
+    assert permit_held == [False]
+    assert not server._FFMPEG_SEMAPHORE.locked()
+    assert MP3_DATA in whisper.requests[0].content
+
+
+def test_ffmpeg_permit_released_while_queued_for_whisper(cache, whisper, ffmpeg, m4a_file):
+    ffmpeg.respond = _convert_ok
+    whisper.respond = _asr_ok
+
+    async def run():
+        await server._ASR_SEMAPHORE.acquire()  # whisper-asr is busy
+        task = asyncio.create_task(
+            server.transcribe(**{**TRANSCRIBE_DEFAULTS, "audio_path": str(m4a_file)})
+        )
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if ffmpeg.requests and not server._FFMPEG_SEMAPHORE.locked():
+                break
+        # Converted and drained: the permit is back before whisper-asr is free
+        assert not server._FFMPEG_SEMAPHORE.locked()
+        assert not whisper.requests
+        server._ASR_SEMAPHORE.release()
+        return await task
+
+    assert asyncio.run(run())["transcription"] == "Hello there.\nGeneral Kenobi.\n"
+    assert MP3_DATA in whisper.requests[0].content
+
+
+def test_fetch_audio_from_url(monkeypatch):
+    backend = FakeBackend()
+    backend.respond = lambda request: httpx.Response(
+        200, content=MP3_DATA, headers={"Content-Disposition": 'attachment; filename="talk.mp3"'}
+    )
+    monkeypatch.setattr(server, "_FETCH_CLIENT", httpx.AsyncClient(transport=httpx.MockTransport(backend)))
+    digest = hashlib.sha256()
+    audio, filename = asyncio.run(server.fetch_audio_from_url("http://example.com/dl?id=1", digest))
+    with audio:
+        audio.seek(0)
+        assert audio.read() == MP3_DATA
+    assert filename == "talk.mp3"
+    assert digest.hexdigest() == hashlib.sha256(MP3_DATA).hexdigest()